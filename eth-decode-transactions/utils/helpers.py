@@ -1,5 +1,6 @@
 import logging
 import os
+from functools import lru_cache
 
 import pandas as pd
 from dotenv import load_dotenv
@@ -17,14 +18,21 @@ dataset_id = os.getenv("dataset")
 table_id = os.getenv("table")
 key_path = os.getenv("bq_key")
 
-w3 = Web3(Web3.HTTPProvider(url))
-credentials = service_account.Credentials.from_service_account_file(key_path)
-client = bigquery.Client(credentials=credentials, project=project_id)
+
+# Clients are built on first use and reused across warm invocations
+@lru_cache(maxsize=1)
+def _w3():
+    return Web3(Web3.HTTPProvider(url))
+
+@lru_cache(maxsize=1)
+def _client():
+    credentials = service_account.Credentials.from_service_account_file(key_path)
+    return bigquery.Client(credentials=credentials, project=project_id)
 
 
 def get_logs(fromBlock, toBlock):
     logger.info("Requesting logs from %s to %s", fromBlock, toBlock)
-    logs = w3.eth.get_logs(
+    logs = _w3().eth.get_logs(
         {
             "fromBlock": fromBlock,
             "toBlock": toBlock,
@@ -44,7 +52,7 @@ def ingest_logs(df):
         len(df),
     )
     try:
-        job = client.load_table_from_dataframe(
+        job = _client().load_table_from_dataframe(
             df, f"{project_id}.{dataset_id}.{table_id}"
         )
         result = job.result()
@@ -55,13 +63,10 @@ def ingest_logs(df):
         logger.exception("Ingestion failed")
         return e
 
-def table_exists():
-    client.get_table(f"{project_id}.{dataset_id}.{table_id}")
-
 def get_block_number():
     query= f"""
     SELECT max(blockNumber) FROM `{project_id}.{dataset_id}.{table_id}` WHERE processed_timestamp= TIMESTAMP_TRUNC(CURRENT_DATE, YEAR)
     """
-    query_job = client.query(query)
+    query_job = _client().query(query)
     results = query_job.result()
     return next(results)[0]
@@ -3,10 +3,15 @@ from google.oauth2 import service_account
 from dotenv import load_dotenv
 import os
 import logging
-from utils.helpers import transfer_hash, table_exists, get_block_number, get_blocks, ingest_decoded_logs, ingest_max_block
+import re
+from utils.helpers import TRANSFER_HASH_BYTES, table_exists, get_block_number, get_blocks, ingest_decoded_logs, ingest_max_block
 import web3 as Web3
+import numpy as np
 import pandas as pd
-import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
 
 if not logging.getLogger().handlers:
     logging.basicConfig(
@@ -16,18 +21,10 @@ if not logging.getLogger().handlers:
 
 logger = logging.getLogger(__name__)
 
-# Cache for environment variables
-_env_vars_loaded = False
-_env_vars = {}
-
 
+@lru_cache(maxsize=1)
 def _load_env_variables():
-    """Load and validate environment variables. Caches results after first call."""
-    global _env_vars_loaded, _env_vars
-    
-    if _env_vars_loaded:
-        return _env_vars
-    
+    """Load and validate environment variables. Caches results after first successful call."""
     try:
         # Load .env file
         load_dotenv()
@@ -58,7 +55,7 @@ def _load_env_variables():
         if missing_vars:
             raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
         
-        _env_vars = {
+        env_vars = {
             "url": url,
             "project_id": project_id,
             "dataset_id": dataset_id,
@@ -67,32 +64,65 @@ def _load_env_variables():
             "table_max_block": table_max_block
         }
         
-        _env_vars_loaded = True
         logger.info("Environment variables loaded and validated successfully")
-        return _env_vars
+        return env_vars
         
     except Exception as e:
         logger.exception(f"Failed to load environment variables: {e}")
         raise
 
 
+_ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+# BigQuery NUMERIC holds at most 29 integer digits
+_NUMERIC_LIMIT = 10 ** 29
+
+
+def _is_address(address):
+    return isinstance(address, str) and _ADDRESS_RE.fullmatch(address) is not None
+
+
+def _is_topic(topic):
+    return isinstance(topic, bytes) and len(topic) == 32
+
+
+def _fits_numeric(data):
+    return not data or (isinstance(data, bytes) and int.from_bytes(data, "big") < _NUMERIC_LIMIT)
+
+
+def _to_numeric(data):
+    return Decimal(int.from_bytes(data, "big") if data else 0)
+
+
+def _decodable(frame):
+    """Per-row mask of logs whose from/to topics and data can be decoded into the decoded tables."""
+    return np.array(
+        [_is_topic(t[1]) and _is_topic(t[2]) and _fits_numeric(d)
+         for t, d in zip(frame["topics"], frame["data"])],
+        dtype=bool
+    )
+
+
+def _drop_malformed(frame, is_valid, token):
+    """Log and drop logs that failed validation so one bad row does not fail the whole batch."""
+    for tx_hash in frame["transactionHash"][~is_valid]:
+        logger.warning(f"Failed to decode {token} log, skipping it. Transaction: {tx_hash}")
+    return frame[is_valid]
+
+
+def _checkpoint_row(max_block):
+    """Build the checkpoint record for the highest processed block as a JSON-ready row."""
+    return {
+        "blockNumber": int(max_block),
+        "processed_timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
 
 def handler(event, context):
     logger.info("Starting decode_logs handler")
     
     # Load environment variables (will be cached after first call)
     try:
-        env_vars = _load_env_variables()
-        # Make env vars available as module-level variables for backwards compatibility
-        
-        globals().update({
-            "url": env_vars["url"],
-            "project_id": env_vars["project_id"],
-            "dataset_id": env_vars["dataset_id"],
-            "table_raw": env_vars["table_raw"],
-            "key_path": env_vars["key_path"],
-            "table_max_block": env_vars["table_max_block"]
-        })
+        _load_env_variables()
     except Exception as e:
         logger.exception("Failed to initialize environment variables")
         return {"status": "error", "message": str(e), "error_type": type(e).__name__}
@@ -129,137 +159,123 @@ def handler(event, context):
         logger.exception(f"Failed to retrieve logs from blocks {block_number} to {to_block_number}")
         return {"status": "error", "message": f"Failed to retrieve logs: {str(e)}", "error_type": type(e).__name__}
     
-    if not logs:
+    if logs.empty:
         logger.warning(f"No logs found for blocks {block_number} to {to_block_number}")
         return {"status": "success", "message": "No logs to process", "processed_count": 0}
     
-    # Process logs
+    # Process logs: decode with column operations instead of a per-log loop
     logger.debug(f"Processing {len(logs)} logs")
-    erc20_data = []
-    erc721_data = []
-    transfer_hash_val = transfer_hash()  # Get transfer hash once
-    
-    for idx, l in enumerate(logs):
-        try:
-            
-            if len(l.topics) > 0  and len(l.topics) == 4:
-                try:
-                    decoded_row = {
-                        "block_number": l.blockNumber,
-                        "block_timestamp": l.blockTimestamp,
-                        "transaction_hash": l.transactionHash,
-                        "from_address": "0x" + l.topics[1][-20:],
-                        "to_address": "0x" + l.topics[2][-20:],
-                        "id": int(l.data.hex(), 16) if l.data else 0,
-                        "processed_timestamp": time.time()
-                    }
-                    erc721_data.append(decoded_row)
-                except (ValueError, IndexError, AttributeError, TypeError) as e:
-                    logger.warning(
-                        f"Failed to decode ERC721 log at index {idx}: {e}. "
-                        f"Transaction: {getattr(l, 'transactionHash', 'unknown')}"
-                    )
-                    continue
-            elif len(l.topics) == 3 and ("0x"+ l.topics[0].hex().lower()) == transfer_hash_val :
+    try:
+        topics = logs["topics"]
+        topic_count = topics.map(lambda t: 0 if t is None else len(t)).to_numpy()
+
+        is_erc721 = topic_count == 4
+        is_erc20 = topic_count == 3
+        is_erc20[is_erc20] = topics[is_erc20].map(lambda t: t[0] == TRANSFER_HASH_BYTES).to_numpy(dtype=bool)
+
+        erc721_logs = logs[is_erc721]
+        erc721_logs = _drop_malformed(erc721_logs, _decodable(erc721_logs), "ERC721")
+        erc20_logs = logs[is_erc20]
+        has_address = np.array([_is_address(a) for a in erc20_logs["address"]], dtype=bool)
+        erc20_logs = _drop_malformed(erc20_logs, _decodable(erc20_logs) & has_address, "ERC20")
+        erc721_topics = erc721_logs["topics"]
+        erc20_topics = erc20_logs["topics"]
+
+        # All rows in a batch share the same ingest time; tz-aware so the Parquet load maps it to TIMESTAMP
+        processed_ts = pd.Timestamp.now(tz="UTC")
+
+        # Addresses stay raw 20-byte values to match the BYTES columns of the decoded tables,
+        # and value/id are Decimals so they load into the NUMERIC columns.
+        # Columns are passed as plain arrays so pandas builds each one directly without index alignment.
+        erc721_df = pd.DataFrame({
+            "block_number": erc721_logs["blockNumber"].to_numpy(),
+            "block_timestamp": erc721_logs["blockTimestamp"].to_numpy(),
+            "transaction_hash": erc721_logs["transactionHash"].to_numpy(),
+            "from_address": [t[1][-20:] for t in erc721_topics],
+            "to_address": [t[2][-20:] for t in erc721_topics],
+            "id": [_to_numeric(d) for d in erc721_logs["data"]]
+        })
+        erc721_df["processed_timestamp"] = processed_ts
+
+        erc20_df = pd.DataFrame({
+            "from_address": [t[1][-20:] for t in erc20_topics],
+            "to_address": [t[2][-20:] for t in erc20_topics],
+            "value": [_to_numeric(d) for d in erc20_logs["data"]],  # Value is in data
+            "contract_address": [bytes.fromhex(a[2:]) for a in erc20_logs["address"]],
+            "transaction_hash": erc20_logs["transactionHash"].to_numpy(),
+            "block_number": erc20_logs["blockNumber"].to_numpy(),
+            "block_timestamp": erc20_logs["blockTimestamp"].to_numpy()
+        })
+        erc20_df["processed_timestamp"] = processed_ts
+    except (KeyError, ValueError, IndexError, AttributeError, TypeError) as e:
+        logger.exception(f"Failed to decode logs from blocks {block_number} to {to_block_number}: {e}")
+        return {"status": "error", "message": f"Failed to decode logs: {str(e)}", "error_type": type(e).__name__}
+
+    logger.info(f"Decoded {len(erc20_df)} ERC20 tokens and {len(erc721_df)} ERC721 tokens")
+
+    # Ingest ERC20 and ERC721 data concurrently; the tables are independent
+    pending = {token: frame for token, frame in (("erc20", erc20_df), ("erc721", erc721_df)) if not frame.empty}
+    ingest_errors = {}
+    if pending:
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = {}
+            for token, frame in pending.items():
+                logger.info(f"Ingesting {len(frame)} {token.upper()} records to BigQuery")
+                futures[token] = executor.submit(ingest_decoded_logs, frame, token)
+            for token, future in futures.items():
                 try:
-                    decoded_row = {
-                        "from_address": "0x" + l.topics[1][-20:],
-                        "to_address": "0x" + l.topics[2][-20:],
-                        "value": int(l.data.hex(), 16) if l.data else 0,  # Value is in data
-                        "contract_address": l.address,
-                        "transaction_hash": l.transactionHash,
-                        "block_number": l.blockNumber,
-                        "processed_timestamp": time.time(),
-                        "block_timestamp": l.blockTimestamp
-                    }
-                    erc20_data.append(decoded_row)
-                except (ValueError, IndexError, AttributeError, TypeError) as e:
-                    logger.warning(
-                        f"Failed to decode ERC20 log at index {idx}: {e}. "
-                        f"Transaction: {getattr(l, 'transactionHash', 'unknown')}"
-                    )
-                    continue
-        except Exception as e:
-            logger.exception(f"Unexpected error processing log at index {idx}: {e}")
-            continue
-
-    logger.info(f"Decoded {len(erc20_data)} ERC20 tokens and {len(erc721_data)} ERC721 tokens")
-
-    # Ingest ERC20 data
-    if erc20_data:
-        try:
-            logger.info(f"Ingesting {len(erc20_data)} ERC20 records to BigQuery")
-            ingest_decoded_logs(pd.DataFrame(erc20_data), "erc20")
-            logger.info("Successfully ingested ERC20 data")
-        except Exception as e:
-            logger.exception(f"Failed to ingest ERC20 data: {e}")
-            return {
-                "status": "partial_error",
-                "message": f"ERC20 ingestion failed: {str(e)}",
-                "erc721_processed": len(erc721_data),
-                "error_type": type(e).__name__
-            }
-       
-    # Ingest ERC721 data
-    if erc721_data:
-        try:
-            logger.info(f"Ingesting {len(erc721_data)} ERC721 records to BigQuery")
-            ingest_decoded_logs(pd.DataFrame(erc721_data), "erc721")
-            logger.info("Successfully ingested ERC721 data")
-        except Exception as e:
-            logger.exception(f"Failed to ingest ERC721 data: {e}")
-            return {
-                "status": "partial_error",
-                "message": f"ERC721 ingestion failed: {str(e)}",
-                "erc20_processed": len(erc20_data),
-                "error_type": type(e).__name__
-            }
-    
-    all_processed = erc20_data + erc721_data
+                    future.result()
+                    logger.info(f"Successfully ingested {token.upper()} data")
+                except Exception as e:
+                    logger.exception(f"Failed to ingest {token.upper()} data: {e}")
+                    ingest_errors[token] = e
+
+    if ingest_errors:
+        return {
+            "status": "partial_error",
+            "message": "; ".join(f"{token.upper()} ingestion failed: {str(e)}" for token, e in ingest_errors.items()),
+            "erc20_processed": 0 if "erc20" in ingest_errors else len(erc20_df),
+            "erc721_processed": 0 if "erc721" in ingest_errors else len(erc721_df),
+            "error_type": type(next(iter(ingest_errors.values()))).__name__
+        }
+
+    processed_count = len(erc20_df) + len(erc721_df)
 
     # Calculate checkpoint
-    if all_processed:
+    if processed_count:
         try:
-            blocks = [item['block_number'] for item in all_processed]
-            if blocks:
-                max_block = max(blocks)
-                logger.info(f"Maximum processed block: {max_block}")
-                
-                checkpoint_row = {
-                    "last_processed_block": max_block,
-                    "updated_at": pd.Timestamp.now()
-                }
-                logger.debug(f"Checkpoint data prepared: {checkpoint_row}")
-                try:
-                    ingest_max_block(checkpoint_row)
-                except Exception as e:
-                    logger.info(f"Failed to ingest decoded block number")
+            max_block = max(frame["block_number"].max() for frame in (erc20_df, erc721_df) if not frame.empty)
+            logger.info(f"Maximum processed block: {max_block}")
 
-                
-            else:
-                logger.warning("No block numbers found in processed data")
+            checkpoint_row = _checkpoint_row(max_block)
+            logger.debug(f"Checkpoint data prepared: {checkpoint_row}")
+            try:
+                ingest_max_block(checkpoint_row)
+            except Exception as e:
+                logger.exception(f"Failed to ingest checkpoint for block {max_block}: {e}")
                 return {
-                    "status": "success",
-                    "message": "Processed logs but no block numbers found",
-                    "processed_count": len(all_processed)
+                    "status": "partial_error",
+                    "message": f"Checkpoint ingestion failed: {str(e)}",
+                    "processed_count": processed_count,
+                    "error_type": type(e).__name__
                 }
         except (KeyError, ValueError) as e:
             logger.exception(f"Failed to determine max block: {e}")
             return {
                 "status": "partial_error",
                 "message": f"Checkpoint update failed: {str(e)}",
-                "processed_count": len(all_processed),
+                "processed_count": processed_count,
                 "error_type": type(e).__name__
             }
     else:
         logger.warning("No data was processed in this run")
     
-    logger.info(f"Handler completed successfully. Processed {len(all_processed)} total records")
+    logger.info(f"Handler completed successfully. Processed {processed_count} total records")
     return {
         "status": "success",
-        "processed_count": len(all_processed),
-        "erc20_count": len(erc20_data),
-        "erc721_count": len(erc721_data)
+        "processed_count": processed_count,
+        "erc20_count": len(erc20_df),
+        "erc721_count": len(erc721_df)
     }
 
 
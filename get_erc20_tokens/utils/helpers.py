@@ -1,18 +1,17 @@
 import logging
 import os
 import time
+from functools import lru_cache
 
 import pandas as pd
 from dotenv import load_dotenv
-from google.cloud import bigquery
+from google.cloud import bigquery, bigquery_storage
 from google.oauth2 import service_account
-from web3 import Web3
 
 logger = logging.getLogger(__name__)
 
 
 load_dotenv()
-url = os.getenv("infura_url") + os.getenv("secret")
 project_id = os.getenv("project")
 dataset_id = os.getenv("dataset")
 table_raw = os.getenv("table_raw")
@@ -23,11 +22,22 @@ table_erc721= os.getenv("table_erc721")
 table_max_block= os.getenv("table_max_block")
 from eth_utils import keccak, to_hex 
 
-w3 = Web3(Web3.HTTPProvider(url))
-credentials = service_account.Credentials.from_service_account_file(key_path)
-client = bigquery.Client(credentials=credentials, project=project_id)
+
+# Clients are built on first use and reused across warm invocations
+@lru_cache(maxsize=1)
+def _credentials():
+    return service_account.Credentials.from_service_account_file(key_path)
+
+@lru_cache(maxsize=1)
+def _client():
+    return bigquery.Client(credentials=_credentials(), project=project_id)
+
+@lru_cache(maxsize=1)
+def _bqstorage_client():
+    return bigquery_storage.BigQueryReadClient(credentials=_credentials())
 
 event_signature= "Transfer(address,address,uint256)"
+TRANSFER_HASH_BYTES = keccak(text=event_signature)
 
 job_config = bigquery.LoadJobConfig(
         write_disposition="WRITE_APPEND",
@@ -42,7 +52,7 @@ def ingest_logs(df):
         len(df),
     )
     try:
-        job = client.load_table_from_dataframe(
+        job = _client().load_table_from_dataframe(
             df, f"{project_id}.{dataset_id}.{table_decoded}"
         )
         result = job.result()
@@ -53,37 +63,44 @@ def ingest_logs(df):
         logger.exception("Ingestion failed")
         return e
 
-def transfer_hash():
-    event_signature = "Transfer(address,address,uint256)"
-    return "0x"+ keccak(text= event_signature).hex()
-
 def table_exists():
-    client.get_table(f"{project_id}.{dataset_id}.{table_max_block}")
+    _client().get_table(f"{project_id}.{dataset_id}.{table_max_block}")
 
 def get_block_number():
     query= f"""
-    SELECT max(blockNumber) FROM `{project_id}.{dataset_id}.{table_max_block}` WHERE processed_timestamp= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 3 DAY)
+    SELECT max(blockNumber) FROM `{project_id}.{dataset_id}.{table_max_block}` WHERE processed_timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 3 DAY)
     """
-    query_job = client.query(query)
+    query_job = _client().query(query)
     results = query_job.result()
     return next(results)[0]
 
 def get_blocks(block_number, to_block_number):
     query= f"""
-    SELECT blockHash, blockNumber,blockTimestamp, data, topics, transactionHash, transactionIndex FROM `{project_id}.{dataset_id}.{table_raw}`
-    WHERE blockNumber >= {block_number}  AND blockNumber <= {to_block_number}"""
-    query_job= client.query(query)
-    query_result= list(query_job.result())
-    return query_result
+    SELECT address, blockHash, blockNumber,blockTimestamp, data, topics, transactionHash, transactionIndex FROM `{project_id}.{dataset_id}.{table_raw}`
+    WHERE blockNumber >= @from_block  AND blockNumber <= @to_block
+    AND ARRAY_LENGTH(topics) IN (3, 4) AND topics[SAFE_OFFSET(0)] = @transfer_hash"""
+    query_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("from_block", "INT64", block_number),
+            bigquery.ScalarQueryParameter("to_block", "INT64", to_block_number),
+            bigquery.ScalarQueryParameter("transfer_hash", "BYTES", TRANSFER_HASH_BYTES),
+        ],
+    )
+    query_job= _client().query(query, job_config=query_config)
+    # Stream the result set as Arrow record batches through the Storage Read API
+    return query_job.result().to_dataframe(bqstorage_client=_bqstorage_client())
 
 def ingest_decoded_logs( df, token):
     if token=='erc20':
         table= table_erc20
     elif token=='erc721':
         table= table_erc721
-    job= client.insert_rows_from_dataframe(table= f"{project_id}.{dataset_id}.{table}", dataframe=df, job_config= job_config)
-    return list(job.result())
+    job= _client().load_table_from_dataframe(df, f"{project_id}.{dataset_id}.{table}", job_config= job_config)
+    return job.result()
 
 def ingest_max_block(block_data):
-    job= client.insert_rows_from_dataframe(table= f"{project_id}.{dataset_id}.{table_max_block}", dataframe=block_data, job_config= job_config)
-    return list(job.result())
\ No newline at end of file
+    # A single checkpoint row is streamed as JSON rather than wrapped in a DataFrame for a load job
+    errors= _client().insert_rows_json(f"{project_id}.{dataset_id}.{table_max_block}", [block_data])
+    if errors:
+        raise RuntimeError(f"Failed to insert checkpoint row: {errors}")
+    return errors
\ No newline at end of file